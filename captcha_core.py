@@ -0,0 +1,511 @@
+# captcha_core.py
+
+import requests
+from requests.adapters import HTTPAdapter
+import os
+import re
+import base64
+import logging
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# OpenCV & numpy (& turbojpeg, which pulls in numpy) aren't needed until a solver exists,
+# so they're loaded when the first one is created & importing the solver modules stays cheap
+cv2 = None
+np = None
+TurboJPEG = None
+TJPF_GRAY = None
+
+# import OpenCV, numpy & the optional turbojpeg decoder (once)
+def _import_cv():
+    global cv2, np, TurboJPEG, TJPF_GRAY
+    if cv2 is None:
+        import numpy as np
+        import cv2
+        # optional SIMD JPEG decoder (pip install PyTurboJPEG), OpenCV is used if it's missing
+        try:
+            from turbojpeg import TurboJPEG, TJPF_GRAY
+        except ImportError:
+            pass
+
+# torch & easyocr take seconds to import, so they're loaded when the first solver is created
+torch = None
+easyocr = None
+
+# import torch & easyocr (once)
+def _import_ocr():
+    global torch, easyocr
+    if easyocr is None:
+        import torch
+        # disable nnpack so it can run on ARM Macs
+        torch.backends.nnpack.enabled = False
+        import easyocr
+
+# shared EasyOCR readers keyed by (langs, gpu, compile_models), so new solvers don't reload the model weights
+_READER_CACHE = {}
+_READER_LOCK = threading.Lock()
+
+# fixed size OCR candidates are letterboxed to, so they can be batched together
+# the height matches the recognizer's input height (64), so EasyOCR's own resize is a same-size no-op
+# (Amazon captchas are ~200x70, so this is also close to native & barely resamples the characters)
+_OCR_WIDTH = 200
+_OCR_HEIGHT = 64
+
+# usual captcha size (h, w) - preprocessing is specialized for it up front, other sizes get their own on first sight
+_CAPTCHA_SHAPE = (70, 200)
+
+# characters the recognizer may output (Amazon captchas are uppercase letters & digits)
+_ALLOWLIST = "ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+
+# common substitutions for OCR errors in Amazon captchas - needs better tuning based on observations of actual Amazon captcha behavior
+_CAPTCHA_TRANSLATE = str.maketrans({'0': 'O', '1': 'I', '5': 'S', '8': 'B'})
+_NON_ALNUM = re.compile(r'[^A-Z0-9]')
+
+# recognizer confidence at which a read is trusted as-is (the substitutions above can break real digits)
+_TRUSTED_CONFIDENCE = 0.9
+
+# returned by _download_captcha_image when the captcha image hasn't changed since the last attempt
+_SAME_IMAGE = object()
+
+# stands in for the debug output helpers when debug output is disabled
+def _noop(*args):
+    pass
+
+# read a resource the page already loaded out of the browser's cache over CDP (Chromium only)
+# send(method, params) issues one CDP command & returns its result
+def _cdp_resource(send, url):
+    send('Page.enable', {})
+    frame_id = send('Page.getFrameTree', {})['frameTree']['frame']['id']
+    resource = send('Page.getResourceContent', {'frameId': frame_id, 'url': url})
+    content = resource['content']
+    return base64.b64decode(content) if resource['base64Encoded'] else content.encode('latin-1')
+
+# run the CRNN recognizer on same-size candidates in one batch, skipping CRAFT detection entirely
+# (the characters fill the captcha, so each candidate is a single text line; they're stacked vertically, one box each)
+# returns one (box, text, confidence) per candidate
+def _recognize_lines(reader, images, allowlist):
+    stacked = np.vstack(images)
+    boxes = [[0, _OCR_WIDTH, i * _OCR_HEIGHT, (i + 1) * _OCR_HEIGHT] for i in range(len(images))]
+    return reader.recognize(stacked, horizontal_list=boxes, free_list=[], detail=1,
+                            allowlist=allowlist, batch_size=len(images))
+
+# run the CRNN recognizer in FP16 on tensor-core GPUs (compute capability 7.0+), falling back to FP32 on failure
+def _half_reader(reader):
+    if not str(reader.device).startswith('cuda') or torch.cuda.get_device_capability()[0] < 7:
+        logger.info("Skipping FP16 recognizer (needs a CUDA GPU w/ compute capability 7.0+).")
+        return
+    
+    recognizer = reader.recognizer
+    forward = recognizer.forward
+    
+    # autocast instead of .half(), since EasyOCR feeds the model FP32 tensors (output goes back to FP32 for decoding)
+    def half_forward(*args, **kwargs):
+        with torch.autocast('cuda', dtype=torch.float16):
+            return forward(*args, **kwargs).float()
+    
+    try:
+        recognizer.forward = half_forward
+        
+        # FP16 can overflow on some weights, so check a blank line decodes to finite scores before keeping it
+        image = torch.zeros((1, 1, _OCR_HEIGHT, _OCR_WIDTH), device=reader.device)
+        text = torch.zeros((1, 1), dtype=torch.long, device=reader.device)
+        with torch.no_grad():
+            if not torch.isfinite(recognizer(image, text)).all():
+                raise ValueError("non-finite output")
+        logger.info("EasyOCR recognizer running in FP16.")
+    except Exception as e:
+        logger.warning(f"FP16 recognizer failed, using FP32: {e}")
+        del recognizer.forward
+
+# compile the CRNN recognizer w/ torch.compile (CUDA only), falling back to eager on failure
+def _compile_reader(reader):
+    if not str(reader.device).startswith('cuda') or not hasattr(torch, 'compile'):
+        logger.info("Skipping torch.compile (needs CUDA & PyTorch 2.x).")
+        return
+    
+    recognizer = reader.recognizer
+    try:
+        reader.recognizer = torch.compile(recognizer, mode="reduce-overhead")
+        
+        # compilation is lazy, so run the model now to pay for it (& surface errors) up front
+        blank = np.zeros((_OCR_HEIGHT, _OCR_WIDTH), np.uint8)
+        _recognize_lines(reader, [blank], _ALLOWLIST)
+        logger.info("EasyOCR recognizer compiled successfully.")
+    except Exception as e:
+        logger.warning(f"torch.compile failed, using eager recognizer: {e}")
+        reader.recognizer = recognizer
+
+# get the shared EasyOCR reader (built & warmed up on first use)
+def _get_reader(langs=('en',), gpu=True, compile_models=False):
+    key = (tuple(langs), gpu, compile_models)
+    
+    # fast path once the reader exists (dict reads are atomic, so no lock needed)
+    reader = _READER_CACHE.get(key)
+    if reader is not None:
+        return reader
+    
+    with _READER_LOCK:
+        # check again - another thread may have built it while we waited for the lock
+        reader = _READER_CACHE.get(key)
+        if reader is None:
+            _import_ocr()
+            # detector=False: the CRAFT model is never used, so don't load it
+            # quantize: on CPU, EasyOCR stores the LSTM/Linear layers as int8 (dynamic quantization)
+            reader = easyocr.Reader(list(key[0]), gpu=key[1], detector=False, quantize=True, cudnn_benchmark=True)
+            _half_reader(reader)
+            if compile_models:
+                _compile_reader(reader)
+            # warm up once w/ a batch shaped like the real one so the first captcha doesn't pay for lazy init
+            blank = np.zeros((_OCR_HEIGHT, _OCR_WIDTH), np.uint8)
+            _recognize_lines(reader, [blank, blank], _ALLOWLIST)
+            _READER_CACHE[key] = reader
+    return reader
+
+# shared EasyOCR captcha solver: download, preprocessing, OCR & the solve loop
+# subclasses implement the browser hooks (see the end of the class) for Selenium / Playwright
+# the required hooks are abstract, so a solver missing one fails when it's created rather than on every attempt
+class _BaseCaptchaSolver(ABC):
+    def __init__(self, output_dir="captcha_failures", save_debug_output=False, compile_models=False):
+        _import_cv()
+        
+        self.output_dir = output_dir
+        self.save_debug_output = save_debug_output
+        
+        # create output directory (if it doesn't exist) & enable debug output
+        if self.save_debug_output and not os.path.exists(self.output_dir):
+            os.makedirs(self.output_dir, exist_ok=True)
+        
+        # persistent HTTP session so captcha downloads reuse the keep-alive connection
+        self._http = requests.Session()
+        self._http.headers.update({'Connection': 'keep-alive'})
+        self._http.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=4))
+        
+        # debug images are encoded & written on their own thread so disk I/O stays off the solve loop
+        self._debug_pool = ThreadPoolExecutor(max_workers=1) if self.save_debug_output else None
+        
+        # bind the debug output helpers once, so the solve loop doesn't branch on save_debug_output
+        if not self.save_debug_output:
+            self._debug_write = self._debug_imwrite = self._debug_screenshot = _noop
+        
+        # src of the last captcha image read successfully (to skip OCR on a repeated image)
+        self._last_src = None
+        
+        # preprocessing specialized for one captcha shape (see _make_preprocess), rebuilt if a captcha has another size
+        self._kernel = np.ones((2, 2), np.uint8)
+        self._preprocess_shape = _CAPTCHA_SHAPE
+        self._preprocess = self._make_preprocess(_CAPTCHA_SHAPE)
+        
+        # turbojpeg decoder for JPEG captchas (also needs the libturbojpeg shared library)
+        self._tj = None
+        if TurboJPEG is not None:
+            try:
+                self._tj = TurboJPEG()
+            except Exception as e:
+                logger.warning(f"Could not load libturbojpeg, decoding w/ OpenCV: {e}")
+
+        try:
+            # init EasyOCR w/ English only (shared across solver instances)
+            self.reader = _get_reader(('en',), gpu=True, compile_models=compile_models)
+            logger.info("EasyOCR initialized successfully.")
+        except Exception as e:
+            logger.error(f"Error initializing EasyOCR: {e}")
+            logger.warning("Please install EasyOCR: pip install easyocr")
+            self.reader = None
+    
+    # download & preprocess the captcha image from page; returns the OCR candidates, _SAME_IMAGE or None
+    def _download_captcha_image(self, browser):
+        try:
+            # locate captcha image
+            image_url = self._captcha_src(browser)
+            
+            # if Amazon hasn't swapped the image yet, poll briefly for the new one
+            polls = 0
+            while image_url and image_url == self._last_src and polls < 10:
+                self._pause(browser, 0.2)
+                image_url = self._captcha_src(browser)
+                polls += 1
+            if image_url and image_url == self._last_src:
+                return _SAME_IMAGE
+            
+            if not image_url:
+                logger.error("Could not find captcha image on page")
+                return None
+            
+            # take the browser's own copy of the image if it can hand it over (no second request / cookie sync)
+            image_data = self._cached_image(browser, image_url)
+            if image_data:
+                self._debug_write("temp_captcha.png", image_data)
+            else:
+                # otherwise download it w/ the browser's cookies so Amazon serves it
+                self._sync_session(browser)
+                image_data = self._fetch_image(image_url)
+            
+            candidates = self._preprocess_image(image_data) if image_data else None
+            
+            # only remember the src once the image was read, so a failed download retries the same image
+            if candidates is not None:
+                self._last_src = image_url
+            return candidates
+            
+        except Exception as e:
+            logger.error(f"Error downloading captcha image: {e}")
+            return None
+    
+    # fetch the captcha image over HTTP
+    def _fetch_image(self, image_url):
+        try:
+            # short connect timeout - a stalled handshake should fail fast & go to the next attempt
+            response = self._http.get(image_url, timeout=(2, 5))
+            
+            # save debug output
+            self._debug_write("temp_captcha.png", response.content)
+            
+            # hand the raw bytes straight to the decoder
+            return response.content
+            
+        except Exception as e:
+            logger.error(f"Error downloading captcha image: {e}")
+            return None
+    
+    # write debug output to disk (runs on the debug pool)
+    def _write_file(self, path, data):
+        with open(path, "wb") as f:
+            f.write(data)
+    
+    # save debug bytes to the output dir in the background
+    def _debug_write(self, filename, data):
+        self._debug_pool.submit(self._write_file, os.path.join(self.output_dir, filename), data)
+    
+    # save a debug image in the background (copied, since the preprocessing buffers are reused)
+    def _debug_imwrite(self, filename, image):
+        self._debug_pool.submit(cv2.imwrite, os.path.join(self.output_dir, filename), image.copy())
+    
+    # save a screenshot in the background (captured here since the browser isn't thread-safe)
+    def _debug_screenshot(self, browser, filename):
+        self._debug_write(filename, self._screenshot(browser))
+    
+    # preprocess the captcha image to improve OCR accuracy; returns the OCR candidates (numpy arrays)
+    # binarized image first, plain grayscale as a fallback if thresholding ate the characters
+    def _preprocess_image(self, image_data):
+        try:
+            # read image straight to grayscale - handle both raw bytes and file paths
+            if isinstance(image_data, (bytes, bytearray)):
+                if self._tj and image_data[:2] == b'\xff\xd8':
+                    # JPEG - decode w/ turbojpeg's SIMD IDCT (returns h x w x 1)
+                    gray = self._tj.decode(image_data, pixel_format=TJPF_GRAY)[:, :, 0]
+                else:
+                    # wrap the bytes as a numpy array (no copy)
+                    nparr = np.frombuffer(image_data, np.uint8)
+                    gray = cv2.imdecode(nparr, cv2.IMREAD_GRAYSCALE)
+            else:
+                gray = cv2.imread(image_data, cv2.IMREAD_GRAYSCALE)
+            
+            # swap in preprocessing specialized for this size if it's not the one we've been seeing
+            if gray.shape != self._preprocess_shape:
+                self._preprocess_shape = gray.shape
+                self._preprocess = self._make_preprocess(gray.shape)
+            
+            return self._preprocess(gray)
+        except Exception as e:
+            logger.error(f"Error preprocessing image: {e}")
+            return None
+    
+    # build the preprocessing for one captcha shape: buffers, letterbox size & padding are worked out once
+    # & captured, so each call is a straight run of OpenCV calls w/o shape checks or allocations
+    # (buffers are reused - safe since the candidates are OCR'd before the next captcha is preprocessed)
+    def _make_preprocess(self, shape):
+        h, w = shape
+        binary, cleaned = np.empty(shape, np.uint8), np.empty(shape, np.uint8)
+        kernel = self._kernel
+        debug_imwrite = self._debug_imwrite
+        
+        # scale to fit the fixed OCR size (keeping aspect ratio) & pad the rest w/ white
+        scale = min(_OCR_WIDTH / w, _OCR_HEIGHT / h)
+        size = (max(1, int(w * scale)), max(1, int(h * scale)))
+        interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+        top, left = (_OCR_HEIGHT - size[1]) // 2, (_OCR_WIDTH - size[0]) // 2
+        border = (top, _OCR_HEIGHT - size[1] - top, left, _OCR_WIDTH - size[0] - left)
+        resized = np.empty((size[1], size[0]), np.uint8)
+        candidates = [np.empty((_OCR_HEIGHT, _OCR_WIDTH), np.uint8) for _ in range(2)]
+        
+        def letterbox(image, out):
+            cv2.resize(image, size, dst=resized, interpolation=interpolation)
+            return cv2.copyMakeBorder(resized, *border, cv2.BORDER_CONSTANT, dst=out, value=255)
+        
+        def preprocess(gray):
+            # applying Otsu threshold to get a binary image (picks the level per image, so varying backgrounds work)
+            # Amazon's background is near-uniform, so no contrast enhancement / blur is needed beforehand
+            # dark characters on white, already the polarity OCR wants
+            cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU, dst=binary)
+            
+            # erode to connect broken parts of the dark characters (same as dilating the inverted image)
+            cv2.erode(binary, kernel, dst=cleaned, iterations=1)
+            
+            # save preprocessing result for debugging if enabled
+            debug_imwrite("preprocessed_captcha.png", cleaned)
+            
+            # binarized image first, the untouched grayscale as the fallback candidate
+            return [letterbox(cleaned, candidates[0]), letterbox(gray, candidates[1])]
+        
+        return preprocess
+            
+    # performing OCR on the preprocessed captcha candidates using EasyOCR
+    def _recognize_captcha(self, images):
+        if self.reader is None:
+            logger.error("EasyOCR not properly initialized")
+            return ""
+        
+        try:
+            # on GPU all candidates go through in one batch; on CPU EasyOCR runs the boxes one at a time,
+            # so the fallback candidate is only read when the binarized one comes back too short
+            if self.reader.device == 'cpu':
+                texts = self._read_candidates(images[:1])
+                if len(texts[0]) < 4:
+                    texts += self._read_candidates(images[1:])
+            else:
+                texts = self._read_candidates(images)
+            
+            # first candidate that looks like a full captcha, otherwise the longest one
+            text = next((text for text in texts if len(text) >= 4), max(texts, key=len, default=""))
+            
+            logger.info(f"EasyOCR recognized: '{text}'")
+            return text
+            
+        except Exception as e:
+            logger.error(f"Error during OCR: {e}")
+            return ""
+        
+    # EasyOCR recognition over the candidates (only allowing alphanumeric characters), one cleaned-up text each
+    def _read_candidates(self, images):
+        results = _recognize_lines(self.reader, images, _ALLOWLIST)
+        
+        # convert to uppercase & fix common errors (see func below)
+        # confident reads skip the substitutions, so a real '0' isn't turned into an 'O'
+        return [self._fix_common_errors(text, substitute=confidence < _TRUSTED_CONFIDENCE)
+                for _, text, confidence in results]
+    
+    # fix common OCR errors in captcha text (may need adjustments)
+    def _fix_common_errors(self, text, substitute=True):
+        # uppercase, remove spaces & non-alphanumeric characters, then apply the substitutions in a single pass
+        text = _NON_ALNUM.sub('', text.upper())
+        return text.translate(_CAPTCHA_TRANSLATE) if substitute else text
+        
+    # solve the captcha on the current page (Selenium driver / Playwright page); true if solved, false if not
+    def solve_captcha(self, browser, max_attempts=3):
+        # check if EasyOCR is available
+        if self.reader is None:
+            logger.error("EasyOCR not available. Cannot solve captcha.")
+            return False
+        
+        # loop until max attempts reached or captcha is solved 
+        attempt = 0
+        while attempt < max_attempts:
+            try:
+                # try to locate captcha input field to confirm on a captcha page
+                input_field = self._find_input(browser)
+                if not input_field:
+                    # no captcha needed
+                    logger.info("No captcha detected on current page.")
+                    return True
+                
+                # download & preprocess the captcha image
+                preprocessed = self._download_captcha_image(browser)
+                if preprocessed is _SAME_IMAGE:
+                    logger.warning("Captcha image unchanged, skipping OCR.")
+                    self._try_different_image(browser)
+                    attempt += 1
+                    continue
+                if preprocessed is None:
+                    logger.error("Failed to download or preprocess captcha image.")
+                    attempt += 1
+                    continue
+                
+                # take a screenshot of the original captcha (for manual analysis if OCR fails)
+                self._debug_screenshot(browser, f"captcha_screenshot_{attempt}.png")
+                
+                # perform OCR
+                captcha_text = self._recognize_captcha(preprocessed)
+                
+                # log attempt
+                logger.info(f"Attempt {attempt+1}: OCR result: '{captcha_text}'")
+                
+                # if OCR returned an empty string / very short text, try another image
+                if len(captcha_text) < 4:
+                    logger.warning("OCR result too short, trying again.")
+                    self._try_different_image(browser)
+                    attempt += 1
+                    continue
+                
+                # enter the captcha text, click continue & wait for the page to load
+                self._submit(browser, input_field, captcha_text)
+                
+                # check if we still on the captcha page
+                if self._find_input(browser):
+                    logger.warning("Still on captcha page, solution failed.")
+                    
+                    # try a different image
+                    self._try_different_image(browser)
+                    
+                    attempt += 1
+                    continue
+                else:
+                    logger.info("Successfully solved captcha!")
+                    return True
+                    
+            except Exception as e:
+                logger.error(f"Error solving captcha: {e}")
+                attempt += 1
+                
+        logger.error(f"Failed to solve captcha after {max_attempts} attempts")
+        # keep the failed captcha files for analysis
+        return False
+        
+    # shut down the debug writer (waits for pending writes) & the HTTP session
+    def close(self):
+        if self._debug_pool:
+            self._debug_pool.shutdown(wait=True)
+        self._http.close()
+        
+    # browser hooks, implemented by the Selenium & Playwright solvers (all required except _cached_image)
+    
+    # captcha input field (None if not on a captcha page)
+    @abstractmethod
+    def _find_input(self, browser):
+        raise NotImplementedError
+    
+    # src of the captcha image currently on the page (None if there isn't one)
+    @abstractmethod
+    def _captcha_src(self, browser):
+        raise NotImplementedError
+    
+    # copy the browser's user agent & cookies into the HTTP session
+    @abstractmethod
+    def _sync_session(self, browser):
+        raise NotImplementedError
+    
+    # captcha image bytes from the browser's cache (None falls back to downloading it over HTTP)
+    def _cached_image(self, browser, image_url):
+        return None
+    
+    # PNG screenshot of the page (bytes)
+    @abstractmethod
+    def _screenshot(self, browser):
+        raise NotImplementedError
+    
+    # wait a short time while polling the page
+    @abstractmethod
+    def _pause(self, browser, seconds):
+        raise NotImplementedError
+    
+    # enter the captcha text, click continue & wait for the page to load
+    @abstractmethod
+    def _submit(self, browser, input_field, captcha_text):
+        raise NotImplementedError
+    
+    # click the 'Try different image' link to get a new captcha image
+    @abstractmethod
+    def _try_different_image(self, browser):
+        raise NotImplementedError
@@ -1,242 +1,97 @@
 # selenium_captcha_solver.py
 
-import cv2
-import numpy as np
-
-# disable nnpack so it can run on ARM Macs
-import torch
-torch.backends.nnpack.enabled = False
-
-import easyocr
-from io import BytesIO
-import requests
+from selenium.common.exceptions import StaleElementReferenceException, TimeoutException, WebDriverException
 from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
 import time
-import os
 import logging
 
+from captcha_core import _BaseCaptchaSolver, _cdp_resource
+
 logger = logging.getLogger(__name__)
 
 # Selenium captcha solver using EasyOCR
-class SeleniumCaptchaSolver:
-    def __init__(self, output_dir="captcha_failures", save_debug_output=False):
-        self.output_dir = output_dir
-        self.save_debug_output = save_debug_output
-        
-        # create output directory (if it doesn't exist) & enable debug output
-        if self.save_debug_output and not os.path.exists(self.output_dir):
-            os.makedirs(self.output_dir, exist_ok=True)
-
-        try:
-            # init EasyOCR w/ English only
-            self.reader = easyocr.Reader(['en'], gpu=True)
-            logger.info("EasyOCR initialized successfully.")
-        except Exception as e:
-            logger.error(f"Error initializing EasyOCR: {e}")
-            logger.warning("Please install EasyOCR: pip install easyocr")
-            self.reader = None
+class SeleniumCaptchaSolver(_BaseCaptchaSolver):
+    # continue button found alongside the input field (reused by _submit on the same page)
+    _submit_button = None
     
-    # download captcha image from page
-    def _download_captcha_image(self, driver):
-        try:
-            # locate captcha image
-            captcha_img = driver.find_element(By.XPATH, "//img[contains(@src, 'captcha')]")
-            image_url = captcha_img.get_attribute('src')
-            
-            # download image
-            response = requests.get(image_url)
-            
-            # save debug output
-            if self.save_debug_output:
-                temp_img_path = os.path.join(self.output_dir, "temp_captcha.png")
-                with open(temp_img_path, "wb") as f:
-                    f.write(response.content)
-                return temp_img_path
-            else:
-                # if not saving debug output, process image directly from memory
-                return BytesIO(response.content)
-            
-        except Exception as e:
-            logger.error(f"Error downloading captcha image: {e}")
-            return None
+    # captcha input field (None if not on a captcha page)
+    # input & continue button come back from one script call, w/o a throw-on-miss round trip when they're missing
+    def _find_input(self, driver):
+        input_field, self._submit_button = driver.execute_script(
+            "return [document.getElementById('captchacharacters'), "
+            "document.evaluate(\"//button[contains(., 'Continue shopping')]\", document, null, "
+            "XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue];")
+        return input_field
+    
+    # src of the captcha image currently on the page (None if there isn't one)
+    # find_elements returns [] on a miss instead of raising, so there's no exception round trip
+    def _captcha_src(self, driver):
+        captcha_imgs = driver.find_elements(By.XPATH, "//img[contains(@src, 'captcha')]")
+        return captcha_imgs[0].get_attribute('src') if captcha_imgs else None
+    
+    # copy the browser's user agent & cookies into the HTTP session
+    def _sync_session(self, driver):
+        self._http.headers['User-Agent'] = driver.execute_script("return navigator.userAgent")
+        for cookie in driver.get_cookies():
+            self._http.cookies.set(cookie['name'], cookie['value'], domain=cookie.get('domain', ''))
     
-    # preprocess the captcha image to improve OCR accuracy (processes image to a nupmy array)
-    def _preprocess_image(self, image_path):
+    # captcha image bytes from Chrome's cache via CDP (None on drivers w/o CDP or if it isn't cached)
+    def _cached_image(self, driver, image_url):
         try:
-            # read image - handle both file paths and BytesIO objects
-            if isinstance(image_path, BytesIO):
-                # convert BytesIO to numpy array
-                nparr = np.frombuffer(image_path.getvalue(), np.uint8)
-                image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-            else:
-                image = cv2.imread(image_path)
-            
-            # convert to grayscale
-            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-            
-            # increasing contrast using histogram equalization
-            clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-            contrast = clahe.apply(gray)
-            
-            # applying gaussian blur to reduce noise
-            blur = cv2.GaussianBlur(contrast, (3, 3), 0)
-            
-            # applying threshold to get a binary image
-            _, binary = cv2.threshold(blur, 170, 255, cv2.THRESH_BINARY_INV)
-            
-            # dilate to connect broken parts of characters
-            kernel = np.ones((2, 2), np.uint8)
-            dilated = cv2.dilate(binary, kernel, iterations=1)
-            
-            # erode to reduce noise
-            eroded = cv2.erode(dilated, np.ones((1, 1), np.uint8), iterations=1)
-            
-            # invert for OCR
-            inverted = cv2.bitwise_not(eroded)
-            
-            # save preprocessing result for debugging if enabled
-            if self.save_debug_output:
-                preprocessed_path = os.path.join(self.output_dir, "preprocessed_captcha.png")
-                cv2.imwrite(preprocessed_path, inverted)
-            
-            return inverted
-        except Exception as e:
-            logger.error(f"Error preprocessing image: {e}")
+            return _cdp_resource(driver.execute_cdp_cmd, image_url)
+        except (AttributeError, KeyError, WebDriverException):
             return None
-            
-    # performing OCR on the preprocessed captcha image using EasyOCR
-    def _recognize_captcha(self, image):
-        if self.reader is None:
-            logger.error("EasyOCR not properly initialized")
-            return ""
-        
-        try:
-            # EasyOCR recognition (only allowing alphanumeric characters)
-            results = self.reader.readtext(image, detail=0, allowlist="ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789")
-            
-            # join results & convert to uppercase
-            text = ''.join(results).upper().strip()
-            
-            # fixing common errors (see func below)
-            text = self._fix_common_errors(text)
-            
-            logger.info(f"EasyOCR recognized: '{text}'")
-            return text
-            
-        except Exception as e:
-            logger.error(f"Error during OCR: {e}")
-            return ""
-        
-    # fix common OCR errors in captcha text (may need adjustments) 
-    def _fix_common_errors(self, text):
-        # remove spaces & non-alphanumeric characters
-        text = ''.join(char for char in text if char.isalnum()).upper()
-        
-        # common substitutions for OCR errors in Amazon captchas
-        replacements = {
-            '0': 'O',  
-            '1': 'I', 
-            '5': 'S', 
-            '8': 'B', 
-        }
-        
-        # apply replacements - needs better tuning based on observations of actual Amazon captcha behavior
-        for error, correction in replacements.items():
-            text = text.replace(error, correction)
-            
-        return text
-        
-    # solve the captcha on the current page; true if solved, false if not 
-    def solve_captcha(self, driver, max_attempts=3):
-        # check if EasyOCR is available
-        if self.reader is None:
-            logger.error("EasyOCR not available. Cannot solve captcha.")
-            return False
+    
+    # PNG screenshot of the page (bytes)
+    def _screenshot(self, driver):
+        return driver.get_screenshot_as_png()
+    
+    # wait a short time while polling the page
+    def _pause(self, driver, seconds):
+        time.sleep(seconds)
+    
+    # enter the captcha text, click continue & wait for the page to load
+    def _submit(self, driver, input_field, captcha_text):
+        input_field.clear()
+        input_field.send_keys(captcha_text)
         
-        # loop until max attempts reached or captcha is solved 
-        attempt = 0
-        while attempt < max_attempts:
+        # click continue (looking the button up again if the cached one is missing or stale)
+        button_xpath = "//button[contains(., 'Continue shopping')]"
+        if self._submit_button is None:
+            driver.find_element(By.XPATH, button_xpath).click()
+        else:
             try:
-                # try to locate captcha input field to confirm on a captcha page
-                try:
-                    input_field = driver.find_element(By.ID, "captchacharacters")
-                except:
-                    # no captcha needed
-                    logger.info("No captcha detected on current page.")
-                    return True
-                
-                # download captcha image
-                image_path = self._download_captcha_image(driver)
-                if not image_path:
-                    logger.error("Could not download captcha image.")
-                    attempt += 1
-                    continue
-                
-                # take a screenshot of the original captcha (for manual analysis if OCR fails)
-                if self.save_debug_output:
-                    screenshot_path = os.path.join(self.output_dir, f"captcha_screenshot_{attempt}.png")
-                    driver.save_screenshot(screenshot_path)
-                
-                # preprocess image & perform OCR
-                preprocessed = self._preprocess_image(image_path)
-                if preprocessed is None:
-                    logger.error("Failed to preprocess image.")
-                    attempt += 1
-                    continue
-                    
-                captcha_text = self._recognize_captcha(preprocessed)
-                
-                # log attempt
-                logger.info(f"Attempt {attempt+1}: OCR result: '{captcha_text}'")
-                
-                # if OCR returned an empty string / very short text, try another image
-                if len(captcha_text) < 4:
-                    logger.warning("OCR result too short, trying again.")
-                    self._try_different_image(driver)
-                    attempt += 1
-                    continue
-                
-                # enter the captcha text
-                input_field.clear()
-                input_field.send_keys(captcha_text)
-                
-                # click continue
-                submit_button = driver.find_element(By.XPATH, "//button[contains(., 'Continue shopping')]")
-                submit_button.click()
-                
-                # wait for page to load
-                time.sleep(3)
-                
-                # check if we still on the captcha page
-                try:
-                    driver.find_element(By.ID, "captchacharacters")
-                    logger.warning("Still on captcha page, solution failed.")
-                    
-                    # try a different image
-                    self._try_different_image(driver)
-                    
-                    attempt += 1
-                    continue
-                except:
-                    logger.info("Successfully solved captcha!")
-                    # clean up successful attempt files
-                    self._cleanup_files(attempt, success=True)
-                    return True
-                    
-            except Exception as e:
-                logger.error(f"Error solving captcha: {e}")
-                attempt += 1
-                
-        logger.error(f"Failed to solve captcha after {max_attempts} attempts")
-        # keep the failed captcha files for analysis
-        return False
+                self._submit_button.click()
+            except StaleElementReferenceException:
+                driver.find_element(By.XPATH, button_xpath).click()
         
+        # wait for the captcha page to unload (instead of a fixed 3s sleep)
+        # a failed solve reloads the captcha page, so wait on the old input going stale rather than on it disappearing
+        try:
+            WebDriverWait(driver, 5).until(EC.staleness_of(input_field))
+        except TimeoutException:
+            pass
+    
     # click the 'Try different image' link to get a new captcha image
     def _try_different_image(self, driver):
         try:
-            link = driver.find_element(By.LINK_TEXT, "Try different image")
-            link.click()
-            # wait for the new image to load
-            time.sleep(1) 
-        except:
+            links = driver.find_elements(By.LINK_TEXT, "Try different image")
+            if not links:
+                logger.warning("Could not find 'Try different image' link")
+                return
+            # the image showing right now (after a failed submit it's already a new one, not the last one read)
+            old_src = self._captcha_src(driver)
+            links[0].click()
+            # wait for the new image to load (returns as soon as the src changes, instead of a fixed 1s sleep)
+            # the img is missing while the page reloads, so only a present image w/ a new src counts
+            def image_changed(d):
+                src = self._captcha_src(d)
+                return src is not None and src != old_src
+            
+            WebDriverWait(driver, 3, ignored_exceptions=(StaleElementReferenceException,)).until(image_changed)
+        except TimeoutException:
+            logger.warning("New captcha image didn't load in time")
+        except WebDriverException:
             logger.warning("Could not click 'Try different image' link")
\ No newline at end of file